@@ -1,8 +1,9 @@
-import itertools
+import collections
+import mmap
+import os
 import pathlib
-import re
 import sys
-from typing import Collection, Optional, Sequence
+from typing import Iterator, Optional, Sequence
 
 import joblib
 import joblib_progress
@@ -15,77 +16,139 @@ import seaborn as sns
 SCRIPT_NAME = pathlib.Path(__file__).name
 
 READS_DIR = pathlib.Path("./data/raw/")
-FORWARD_STARTER = "CTGTGAATGGCTCCTTACATCAG"
-REVERSE_STARTER = "CTSCCTCTCCGGAATCRAAC"
-SPECIAL_BASES = {"R": "[AG]", "S": "[CG]"}
-
-
-def count_sequences_with(pattern: re.Pattern, sequences: Collection[str]) -> int:
-    n = 0
-    for sequence in sequences:
-        if pattern.match(sequence) is not None:
-            n += 1
-    return n
-
-
-def prepare_regex_pattern(
-    string: str, mapping: Optional[dict[str, str]] = None
-) -> re.Pattern:
-    if mapping is None:
-        return re.compile(string)
+FORWARD_STARTER = b"CTGTGAATGGCTCCTTACATCAG"
+REVERSE_STARTER = b"CTSCCTCTCCGGAATCRAAC"
+# Keyed by byte value, since that is what iterating over bytes yields.
+SPECIAL_BASES = {ord("R"): b"AG", ord("S"): b"CG"}
+DIRECTIONS = {"1": "Forward", "2": "Reverse"}
+MAX_STARTER_OFFSET = 13
+N_JOBS = min(12, os.cpu_count() or 1)
+
+
+def read_sequences(
+    file_path: pathlib.Path, block_size: int = 1 << 24
+) -> Iterator[bytes]:
+    """Yields sequence lines of a fastq file as undecoded bytes."""
+    with open(file_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # The file is split into lines a block at a time, in C, and lines
+            # of records cut by a block boundary are carried to the next one.
+            carry: list[bytes] = []
+            start = 0
+            while start < len(mm):
+                end = mm.find(b"\n", start + block_size) + 1 or len(mm)
+                lines = carry + mm[start:end].splitlines()
+                n_record_lines = len(lines) // 4 * 4
+                yield from lines[1:n_record_lines:4]
+                carry = lines[n_record_lines:]
+                start = end
+            if len(carry) > 1:
+                yield carry[1]
+
+
+def prepare_starter_table(sequence: bytes, mapping: dict[int, bytes]) -> np.ndarray:
+    """Returns a (len(sequence), 256) table of bytes allowed at each position."""
+    table = np.zeros((len(sequence), 256), dtype=bool)
+    for position, base in enumerate(sequence):
+        table[position, list(mapping.get(base, (base,)))] = True
+    # Tables are built once and shared by the scans of every file.
+    table.flags.writeable = False
+    return table
+
+
+def count_starter_matches(
+    prefixes: np.ndarray,
+    n_reads: np.ndarray,
+    starter_table: np.ndarray,
+    offsets: Sequence[int],
+) -> dict[int, int]:
+    # Reads are matched against the starter with first `i` bases removed, so a
+    # read can fall into more than one bucket, or into none of them, and counts
+    # can't be derived from each other. Prefixes are compared base by base,
+    # keeping only those still matching, until none are left. Prefixes are
+    # zero-padded and zero is never an allowed byte, so reads shorter than the
+    # pattern don't match.
+    starter_length = len(starter_table)
+    occurances = {}
+    for i in offsets:
+        candidates = np.arange(len(prefixes))
+        for base, position in enumerate(range(i, starter_length)):
+            candidates = candidates[starter_table[position, prefixes[candidates, base]]]
+            if len(candidates) == 0:
+                break
+        occurances[i] = int(n_reads[candidates].sum())
+    return occurances
 
-    for k, v in mapping.items():
-        string = string.replace(k, v)
-    return re.compile(f"^{string}")
 
+def count_starters_in_file(file: pathlib.Path, starter_table: np.ndarray):
+    starter_length = len(starter_table)
+    offsets = range(min(MAX_STARTER_OFFSET, starter_length), -1, -1)
+    # Only the first len(starter) bases decide which buckets a read falls into
+    # and amplicon reads share very few distinct prefixes, so each prefix is
+    # matched once and weighted by the number of reads starting with it.
+    prefixes = collections.Counter(
+        sequence[:starter_length] for sequence in read_sequences(file)
+    )
+    packed_prefixes = np.frombuffer(
+        b"".join(prefix.ljust(starter_length, b"\0") for prefix in prefixes),
+        dtype=np.uint8,
+    ).reshape(-1, starter_length)
+    n_reads = np.fromiter(prefixes.values(), dtype=np.int64, count=len(prefixes))
 
-def count_starters_in_file(file: pathlib.Path, starter_sequence: str):
-    with open(file, "r") as f:
-        lines = [line.strip() for line in itertools.islice(f, 1, None, 4)]
+    return count_starter_matches(packed_prefixes, n_reads, starter_table, offsets)
 
-    occurances = {}
-    for i in range(13, -1, -1):
-        if i > len(starter_sequence):
-            i = len(starter_sequence)
-        forward_starter_re = prepare_regex_pattern(starter_sequence[i:], SPECIAL_BASES)
-        starter_occurances = count_sequences_with(forward_starter_re, lines)
-        occurances[i] = starter_occurances
 
-    return occurances
+def starter_counts_row(file: pathlib.Path, starter_table: np.ndarray) -> np.ndarray:
+    # Columns hold offsets from MAX_STARTER_OFFSET down to 0.
+    row = np.zeros(MAX_STARTER_OFFSET + 1, dtype=np.int64)
+    for i, n_reads in count_starters_in_file(file, starter_table).items():
+        row[MAX_STARTER_OFFSET - i] = n_reads
+    return row
 
 
 def calculate_starter_stats(
     input_directory: pathlib.Path,
-    forward_starter: str,
-    reverse_starter: str,
+    forward_starter: bytes,
+    reverse_starter: bytes,
 ) -> pd.DataFrame:
     fastq_forward_files: list[pathlib.Path] = list(input_directory.glob("*1.fastq"))
     fastq_reverse_files: list[pathlib.Path] = list(input_directory.glob("*2.fastq"))
 
-    file_starter_pairs: Sequence[tuple[pathlib.Path, str]] = [
-        (file, forward_starter) for file in fastq_forward_files
-    ] + [(file, reverse_starter) for file in fastq_reverse_files]
+    forward_table = prepare_starter_table(forward_starter, SPECIAL_BASES)
+    reverse_table = prepare_starter_table(reverse_starter, SPECIAL_BASES)
+    file_starter_pairs: Sequence[tuple[pathlib.Path, np.ndarray]] = [
+        (file, forward_table) for file in fastq_forward_files
+    ] + [(file, reverse_table) for file in fastq_reverse_files]
 
     with joblib_progress.joblib_progress(
         description="Counting starters in fastq files...", total=len(file_starter_pairs)
     ):
-        starter_occurances = joblib.Parallel(n_jobs=12)(
-            joblib.delayed(count_starters_in_file)(file, starter)
+        # The scan is pure Python and holds the GIL, so files are processed in
+        # worker processes; each returns only a small row.
+        rows = joblib.Parallel(n_jobs=N_JOBS, batch_size="auto")(
+            joblib.delayed(starter_counts_row)(file, starter)
             for file, starter in file_starter_pairs
         )
 
-    starter_occurances_per_file = {
-        path.stem: occurances
-        for (path, _), occurances in zip(file_starter_pairs, starter_occurances)
-    }
-    df = pd.DataFrame(starter_occurances_per_file).transpose()
+    # Each worker returns a single small row, which are stacked in file order.
+    starter_occurances = np.array(rows, dtype=np.int64).reshape(
+        len(file_starter_pairs), MAX_STARTER_OFFSET + 1
+    )
+    df = pd.DataFrame(
+        starter_occurances,
+        index=[path.stem for path, _ in file_starter_pairs],
+        columns=range(MAX_STARTER_OFFSET, -1, -1),
+    )
     return df
 
 
-def get_lengths(file_path: pathlib.Path) -> tuple[str, pd.Series]:
-    with open(file_path, "r") as f:
-        lengths = [len(line.strip()) for line in itertools.islice(f, 1, None, 4)]
-    return file_path.stem, pd.Series(lengths)
+def get_lengths(file_path: pathlib.Path) -> tuple[str, Optional[str], np.ndarray]:
+    lengths = np.fromiter(map(len, read_sequences(file_path)), dtype=np.int32)
+    direction = DIRECTIONS.get(file_path.stem[-1:])
+    # Histogram of read lengths, indexed by length.
+    return file_path.stem, direction, np.bincount(lengths)
 
 
 def calculate_reads_lengths(
@@ -93,25 +156,66 @@ def calculate_reads_lengths(
 ):
     files: list[pathlib.Path] = list(input_directory.glob("*fastq"))
 
+    names: list[np.ndarray] = []
+    directions: list[np.ndarray] = []
+    read_lengths: list[np.ndarray] = []
+    counts: list[np.ndarray] = []
     with joblib_progress.joblib_progress(
         description="Calculating reads lengths in fastq files...", total=len(files)
     ):
-        reads_lengths = joblib.Parallel(n_jobs=12)(
-            joblib.delayed(get_lengths)(path) for path in files
-        )
-
-    if reads_lengths is not None:
-        df = pd.DataFrame({name: lengths for name, lengths in reads_lengths}).melt().dropna()  # type: ignore
-        df["direction"] = (
-            df["variable"].str[-1].map({"1": "Forawrd", "2": "Reverse"}).tolist()
-        )
-        df.columns = ["Sample ID", "Read length", "Direction"]
-    else:
+        reads_lengths = joblib.Parallel(
+            n_jobs=N_JOBS,
+            batch_size="auto",
+            return_as="generator_unordered",
+        )(joblib.delayed(get_lengths)(path) for path in files)
+
+        # Build the long table, one row per observed read length, as files
+        # are processed.
+        for name, direction, histogram in reads_lengths:
+            file_lengths = np.flatnonzero(histogram)
+            names.append(np.repeat(name, len(file_lengths)))
+            directions.append(np.repeat(direction, len(file_lengths)))
+            read_lengths.append(file_lengths)
+            counts.append(histogram[file_lengths])
+
+    if not read_lengths:
         raise ValueError
 
+    df = pd.DataFrame(
+        {
+            "Sample ID": pd.Categorical(np.concatenate(names)),
+            "Read length": np.concatenate(read_lengths),
+            "Count": np.concatenate(counts),
+            "Direction": pd.Categorical(np.concatenate(directions)),
+        }
+    )
     return df
 
 
+def histogram_boxplot_stats(
+    read_lengths: np.ndarray, counts: np.ndarray, label: Optional[str] = None
+) -> dict:
+    """Returns boxplot statistics, as expected by `Axes.bxp`, of a histogram."""
+    order = np.argsort(read_lengths)
+    read_lengths, counts = read_lengths[order], counts[order]
+    cumulative_counts = np.cumsum(counts)
+    quartile_counts = np.array([0.25, 0.5, 0.75]) * cumulative_counts[-1]
+    q1, median, q3 = read_lengths[np.searchsorted(cumulative_counts, quartile_counts)]
+    iqr = q3 - q1
+    within_whiskers = read_lengths[
+        (read_lengths >= q1 - 1.5 * iqr) & (read_lengths <= q3 + 1.5 * iqr)
+    ]
+    return {
+        "label": label,
+        "med": median,
+        "q1": q1,
+        "q3": q3,
+        "whislo": within_whiskers.min(),
+        "whishi": within_whiskers.max(),
+        "fliers": [],
+    }
+
+
 def main() -> int:
     # df = calculate_starter_stats(READS_DIR, FORWARD_STARTER, REVERSE_STARTER)
     # df.to_csv("./data/intermediate/starter_o curances.tsv", sep="\t")
@@ -121,8 +225,16 @@ def main() -> int:
     fig, axs = plt.subplots(
         nrows=2, ncols=1, gridspec_kw={"height_ratios": [2, 1]}, sharex=True
     )
-    sns.histplot(df, x="Read length", hue="Direction", ax=axs[0], bins=100)
-    sns.boxplot(df, x="Read length", hue="Direction", ax=axs[1], legend=False, showfliers=False)
+    sns.histplot(
+        df, x="Read length", weights="Count", hue="Direction", ax=axs[0], bins=100
+    )
+    boxplot_stats = [
+        histogram_boxplot_stats(
+            group["Read length"].to_numpy(), group["Count"].to_numpy(), label=direction
+        )
+        for direction, group in df.groupby("Direction", observed=True)
+    ]
+    axs[1].bxp(boxplot_stats, vert=False, showfliers=False)
     plt.tight_layout()
     plt.show()
 
@@ -1,11 +1,12 @@
 #!/usr/bin/env python
 import argparse
 import datetime
+import functools
 import logging
 import pathlib
 import shutil
 import sys
-from typing import Union
+from typing import Optional, Union
 
 from euglenida import quality_control
 from euglenida import preprocessing
@@ -21,14 +22,21 @@ DEFAULT_TMP_DIR = "./data/tmp"
 DEFAULT_FASTQC_DIRNAME = "fastqc"
 DEFAULT_MULTIQC_DIRNAME = "multiqc"
 
-FASTQC_PATH = shutil.which("fastqc")
-MULTIQC_PATH = shutil.which("multiqc")
-QIIME2_PATH = shutil.which("qiime")
+FASTQC_EXECUTABLE = "fastqc"
+MULTIQC_EXECUTABLE = "multiqc"
+QIIME2_EXECUTABLE = "qiime"
 
 LOGGING_DATEFMT = "%Y-%m-%d %H:%M:%S"
 VERBOSITY = 30
 
 
+# Executables are looked up in $PATH only when a command that needs them runs,
+# instead of on every start of the program.
+@functools.cache
+def which(executable: str) -> Optional[str]:
+    return shutil.which(executable)
+
+
 class CustomFormatter(logging.Formatter):
     grey = "\033[90m"  # ]
     white = "\033[37m"  # ]
@@ -140,8 +148,7 @@ def parse_args() -> argparse.Namespace:
     qa_parser.add_argument(
         "--fastqc-path",
         type=str,
-        default=FASTQC_PATH,
-        help=f"path to fastqc executable. Default: {FASTQC_PATH}",
+        help=f"path to fastqc executable. Default: `{FASTQC_EXECUTABLE}` found in $PATH.",
     )
     qa_parser.add_argument(
         "--multiqc-dirname",
@@ -152,8 +159,7 @@ def parse_args() -> argparse.Namespace:
     qa_parser.add_argument(
         "--multiqc-path",
         type=str,
-        default=MULTIQC_PATH,
-        help=f"path to multiqc executable. Default: {MULTIQC_PATH}",
+        help=f"path to multiqc executable. Default: `{MULTIQC_EXECUTABLE}` found in $PATH.",
     )
     qa_parser.add_argument(
         "-t",
@@ -180,7 +186,7 @@ def parse_args() -> argparse.Namespace:
         help="path to qiime2 manifest csv file. Can be genereated using `generate_qiime_manifest` script.",
     )
     preprocessing_parser.add_argument(
-        "--qiime-path", type=str, default=QIIME2_PATH, help="path to qiime2 executable."
+        "--qiime-path", type=str, help="path to qiime2 executable."
     )
     preprocessing_parser.add_argument(
         "--verbose", action="store_true", help="make the program more verbose."
@@ -262,7 +268,7 @@ def parse_args() -> argparse.Namespace:
         help="path to qiime2 artifact file with table after filtering.",
     )
     taxonomy_parser.add_argument(
-        "--qiime-path", type=str, default=QIIME2_PATH, help="path to qiime2 executable."
+        "--qiime-path", type=str, help="path to qiime2 executable."
     )
     taxonomy_parser.add_argument(
         "--verbose", action="store_true", help="make the program more verbose."
@@ -302,7 +308,7 @@ def parse_args() -> argparse.Namespace:
         help="path to qiime2 artifact file with sequences, for which the tree will be constructed.",
     )
     tree_parser.add_argument(
-        "--qiime-path", type=str, default=QIIME2_PATH, help="path to qiime2 executable."
+        "--qiime-path", type=str, help="path to qiime2 executable."
     )
     tree_parser.add_argument(
         "--verbose", action="store_true", help="make the program more verbose."
@@ -346,8 +352,12 @@ def euglenins() -> int:
     logger = setup_logger(log_filepath, logging_level=VERBOSITY)
 
     if args.command == "qc":
+        args.fastqc_path = args.fastqc_path or which(FASTQC_EXECUTABLE)
+        args.multiqc_path = args.multiqc_path or which(MULTIQC_EXECUTABLE)
         return quality_control.quality_control(args, logger, script_name=SCRIPT_NAME)
-    elif args.command == "preprocess" or args.command == "pp":
+
+    args.qiime_path = args.qiime_path or which(QIIME2_EXECUTABLE)
+    if args.command == "preprocess" or args.command == "pp":
         return preprocessing.preprocess(args, logger, script_name=SCRIPT_NAME)
     elif args.command == "taxonomy" or args.command == "classify":
         return taxonomy.classify(args, logger, script_name=SCRIPT_NAME)
@@ -1,4 +1,5 @@
 import pathlib
+import shutil
 import sys
 import zipfile
 
@@ -26,15 +27,37 @@ def main() -> int:
 
     dfs = []
     for path, name in zip(paths, params):
-        with zipfile.ZipFile(path, "r") as zip_handler:
-            zip_handler.extractall(results_dir / name)
+        # Only the stats table is needed from the artifact. It is extracted
+        # once and reused until the artifact is newer than the extraction.
+        extracted_dir = results_dir / name
+        extracted_flag = extracted_dir / ".extracted"
+        if (
+            not extracted_flag.exists()
+            or extracted_flag.stat().st_mtime <= path.stat().st_mtime
+        ):
+            with zipfile.ZipFile(path, "r") as zip_handler:
+                stats_members = [
+                    member
+                    for member in zip_handler.namelist()
+                    if member.endswith("/stats.tsv")
+                ]
+                if not stats_members:
+                    raise ValueError(f"{path}: artifact contains no stats.tsv")
+                shutil.rmtree(extracted_dir, ignore_errors=True)
+                zip_handler.extractall(extracted_dir, members=stats_members)
+            extracted_flag.touch()
 
-        stats_path = pathlib.Path(results_dir / name).glob("**/stats.tsv")
-        if stats_path:
-            stats_path = next(stats_path).resolve()
+        stats_path = next(extracted_dir.glob("**/stats.tsv")).resolve()
 
         df = (
-            pd.read_csv(stats_path, sep="\t", skiprows=[1], index_col=0)[COLUMNS]
+            pd.read_csv(
+                stats_path,
+                sep="\t",
+                skiprows=[1],
+                index_col="sample-id",
+                usecols=["sample-id", *COLUMNS],
+                dtype={column: "float32" for column in COLUMNS},
+            )
             .stack()
             .rename(name)
         )
@@ -44,18 +67,22 @@ def main() -> int:
     split_into = 6
     fig, ax = plt.subplots(nrows=split_into, ncols=1,figsize=(15,5), sharey=True)
 
+    all_data = (
+        pd.concat(dfs, axis=1)
+        .stack(level=0)
+        .reset_index()
+        .set_index("sample-id")
+        .rename(columns={"level_1": "variable", "level_2": "group", 0: "value"})
+    )
+
     print(len(dfs))
     step = len(dfs) // split_into
     for i, dfs_window_start in enumerate(range(0, len(dfs), step)):
         dfs_window_stop = dfs_window_start + step
         print(i, dfs_window_start, dfs_window_stop)
-        data = (
-            pd.concat(dfs[dfs_window_start:dfs_window_stop], axis=1)
-            .stack(level=0)
-            .reset_index()
-            .set_index("sample-id")
-            .rename(columns={"level_1": "variable", "level_2": "group", 0: "value"})
-        )
+        data = all_data[
+            all_data["group"].isin(params[dfs_window_start:dfs_window_stop])
+        ]
 
         sns.boxplot(data, x="group", y='value', hue="variable", ax=ax[i])
         ax[i].tick_params(rotation=10)
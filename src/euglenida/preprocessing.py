@@ -1,8 +1,10 @@
 import argparse
+import functools
 import itertools
+import os
 import pathlib
 from logging import Logger
-from typing import List, Tuple, Union
+from typing import List, Mapping, Tuple
 
 import joblib
 
@@ -11,8 +13,8 @@ from euglenida import utils
 
 def qiime_tools_import(
     qiime_path: str,
-    input_path: Union[pathlib.Path, str],
-    output_path: Union[pathlib.Path, str],
+    input_path: str,
+    output_path: str,
 ) -> List[str]:
     return [
         qiime_path,
@@ -23,119 +25,302 @@ def qiime_tools_import(
         "--input-format",
         "PairedEndFastqManifestPhred33",
         "--input-path",
-        f"{input_path}",
+        input_path,
         "--output-path",
-        f"{output_path}",
+        output_path,
     ]
 
 
 def qiime_demux_summarize(
     qiime_path: str,
-    imported_reads_filepath: Union[pathlib.Path, str],
-    output_visualization_path: Union[pathlib.Path, str],
+    imported_reads_filepath: str,
+    output_visualization_path: str,
 ) -> List[str]:
     return [
         qiime_path,
         "demux",
         "summarize",
         "--i-data",
-        f"{imported_reads_filepath}",
+        imported_reads_filepath,
         "--o-visualization",
-        f"{output_visualization_path}",
+        output_visualization_path,
     ]
 
 
-def qiime_dada2(
+def qiime_dada2_prefix(
     qiime_path: str,
-    imported_reads_filepath: Union[pathlib.Path, str],
-    stats_output_filename: Union[pathlib.Path, str],
-    filtered_sequences_filename: Union[pathlib.Path, str],
-    summary_table_filename: Union[pathlib.Path, str],
-    truncate_forward_at: int,
-    truncate_reverse_at: int,
-    trim_forward_by: int,
-    trim_reverse_by: int,
-    truncate_threshold_quality: int,
+    imported_reads_filepath: str,
     verbose: bool,
     chimera_method: str = "consensus",
-) -> List[str]:
-    command = [
+) -> Tuple[str, ...]:
+    prefix = (
         qiime_path,
         "dada2",
         "denoise-paired",
         "--i-demultiplexed-seqs",
-        f"{imported_reads_filepath}",
+        imported_reads_filepath,
+        "--p-chimera-method",
+        chimera_method,
+    )
+    if verbose:
+        prefix += ("--verbose",)
+    return prefix
+
+
+def qiime_dada2(
+    prefix: Tuple[str, ...],
+    stats_output_filename: str,
+    filtered_sequences_filename: str,
+    summary_table_filename: str,
+    truncate_forward_at: int,
+    truncate_reverse_at: int,
+    trim_forward_by: int,
+    trim_reverse_by: int,
+    truncate_threshold_quality: int,
+) -> List[str]:
+    return [
+        *prefix,
         "--p-trunc-len-f",
-        f"{truncate_forward_at}",
+        str(truncate_forward_at),
         "--p-trunc-len-r",
-        f"{truncate_reverse_at}",
+        str(truncate_reverse_at),
         "--p-trim-left-f",
-        f"{trim_forward_by}",
+        str(trim_forward_by),
         "--p-trim-left-r",
-        f"{trim_reverse_by}",
-        "--p-chimera-method",
-        f"{chimera_method}",
+        str(trim_reverse_by),
         "--p-trunc-q",
-        f"{truncate_threshold_quality}",
+        str(truncate_threshold_quality),
         "--o-denoising-stats",
-        f"{stats_output_filename}",
+        stats_output_filename,
         "--o-representative-sequences",
-        f"{filtered_sequences_filename}",
+        filtered_sequences_filename,
         "--o-table",
-        f"{summary_table_filename}",
+        summary_table_filename,
     ]
-    if verbose:
-        command.append("--verbose")
-    return command
 
 
 def qiime_metadata_tabulate(
     qiime_path: str,
-    input_stats_filename: Union[pathlib.Path, str],
-    output_stats_filename: Union[pathlib.Path, str],
+    input_stats_filename: str,
+    output_stats_filename: str,
 ) -> List[str]:
     return [
         qiime_path,
         "metadata",
         "tabulate",
         "--m-input-file",
-        f"{input_stats_filename}",
+        input_stats_filename,
         "--o-visualization",
-        f"{output_stats_filename}",
+        output_stats_filename,
     ]
 
 
 def qiime_feature_table_summarize(
     qiime_path: str,
-    input_table: Union[pathlib.Path, str],
-    output_table: Union[pathlib.Path, str],
+    input_table: str,
+    output_table: str,
 ) -> List[str]:
     return [
         qiime_path,
         "feature-table",
         "summarize",
         "--i-table",
-        f"{input_table}",
+        input_table,
         "--o-visualization",
-        f"{output_table}",
+        output_table,
     ]
 
 
 def qiime_tools_export(
     qiime_path: str,
-    input_path: Union[pathlib.Path, str],
-    output_dir: Union[pathlib.Path, str],
+    input_path: str,
+    output_dir: str,
 ) -> List[str]:
     return [
         qiime_path,
         "tools",
         "export",
         "--input-path",
-        f"{input_path}",
+        input_path,
         "--output-path",
-        f"{output_dir}",
+        output_dir,
+    ]
+
+
+def export_dirs(
+    output_dir: pathlib.Path, parameters: Tuple[int, ...]
+) -> Tuple[pathlib.Path, pathlib.Path]:
+    suffix = "_".join(map(str, parameters))
+    return (
+        output_dir / f"filtering_table_{suffix}",
+        output_dir / f"filtered_reads_{suffix}",
+    )
+
+
+def is_up_to_date(output: pathlib.Path, source: pathlib.Path) -> bool:
+    # A directory counts as up to date if any of its entries is newer than the
+    # source; an empty or missing output never is.
+    try:
+        source_mtime = source.stat().st_mtime
+        if output.is_dir():
+            with os.scandir(output) as entries:
+                output_mtime = max(
+                    (entry.stat().st_mtime for entry in entries), default=None
+                )
+            if output_mtime is None:
+                return False
+        else:
+            output_mtime = output.stat().st_mtime
+    except FileNotFoundError:
+        return False
+    return output_mtime > source_mtime
+
+
+def filter_and_merge(
+    args: argparse.Namespace,
+    logger: Logger,
+    script_name: str,
+    output_dir: pathlib.Path,
+    env_with_tmpdir: Mapping[str, str],
+    imported_reads_path: pathlib.Path,
+    dada2_prefix: Tuple[str, ...],
+    trunc_f: int,
+    trunc_r: int,
+    trim_f: int,
+    trim_r: int,
+    trunc_q: int,
+) -> None:
+    filtering_stats_path = (
+        output_dir
+        / f"filtering_stats_{trunc_f}_{trunc_r}_{trim_f}_{trim_r}_{trunc_q}.qza"
+    )
+    logger.debug(f"filtering stats path: {filtering_stats_path}")
+
+    filtered_sequences_path = (
+        output_dir
+        / f"filtered_reads_{trunc_f}_{trunc_r}_{trim_f}_{trim_r}_{trunc_q}.qza"
+    )
+    logger.debug(f"filtered sequences path: {filtering_stats_path}")
+
+    filtering_table_path = (
+        output_dir
+        / f"filtering_table_{trunc_f}_{trunc_r}_{trim_f}_{trim_r}_{trunc_q}.qza"
+    )
+    logger.debug(f"filtering table path: {filtering_stats_path}")
+
+    filtering_stats = str(filtering_stats_path)
+    filtered_sequences = str(filtered_sequences_path)
+    filtering_table = str(filtering_table_path)
+    filtering_stats_visualization_path = filtering_stats_path.with_suffix(".qzv")
+    filtering_table_visualization_path = filtering_table_path.with_suffix(".qzv")
+    filtering_stats_visualization = str(filtering_stats_visualization_path)
+    filtering_table_visualization = str(filtering_table_visualization_path)
+    filtering_table_dir, filtered_sequences_dir = export_dirs(
+        output_dir, (trunc_f, trunc_r, trim_f, trim_r, trunc_q)
+    )
+
+    # Steps whose outputs are newer than their inputs, e.g. from an interrupted
+    # earlier run, are skipped. Everything after dada2 is rerun whenever dada2
+    # itself runs, so no step is left with outputs of older reads.
+    dada2_ran = not all(
+        is_up_to_date(path, imported_reads_path)
+        for path in (filtering_stats_path, filtered_sequences_path, filtering_table_path)
+    )
+    if not dada2_ran:
+        logger.info(
+            f"dada2 outputs for parameters {(trunc_f, trunc_r, trim_f, trim_r, trunc_q)} are up to date; skipping it."
+        )
+    else:
+        dada2_command = qiime_dada2(
+            dada2_prefix,
+            filtering_stats,
+            filtered_sequences,
+            filtering_table,
+            truncate_forward_at=trunc_f,
+            truncate_reverse_at=trunc_r,
+            trim_forward_by=trim_f,
+            trim_reverse_by=trim_r,
+            truncate_threshold_quality=trunc_q,
+        )
+
+        utils.log_command(logger, dada2_command)
+        # Combinations run concurrently, so dada2 output is tagged with its own.
+        utils.run_command_with_output(
+            dada2_command,
+            env_with_tmpdir,
+            args,
+            script_name,
+            logger,
+            label=f"dada2 {trunc_f}_{trunc_r}_{trim_f}_{trim_r}_{trunc_q}",
+        )
+
+    filtering_stats_command = qiime_metadata_tabulate(
+        args.qiime_path,
+        filtering_stats,
+        filtering_stats_visualization,
+    )
+    table_visualiztion_command = qiime_feature_table_summarize(
+        args.qiime_path,
+        filtering_table,
+        filtering_table_visualization,
+    )
+    visualization_commands = [
+        command
+        for command, output, source in (
+            (
+                filtering_stats_command,
+                filtering_stats_visualization_path,
+                filtering_stats_path,
+            ),
+            (
+                table_visualiztion_command,
+                filtering_table_visualization_path,
+                filtering_table_path,
+            ),
+        )
+        if dada2_ran or not is_up_to_date(output, source)
     ]
 
+    # Visualizations of stats and table don't depend on each other.
+    for command in visualization_commands:
+        utils.log_command(logger, command)
+    if visualization_commands:
+        utils.run_commands_concurrently(
+            visualization_commands,
+            env_with_tmpdir,
+            args,
+            script_name,
+            logger,
+        )
+
+    table_export_command = qiime_tools_export(
+        args.qiime_path, filtering_table, str(filtering_table_dir)
+    )
+
+    sequences_export_command = qiime_tools_export(
+        args.qiime_path, filtered_sequences, str(filtered_sequences_dir)
+    )
+    export_commands = [
+        command
+        for command, export_dir, source in (
+            (table_export_command, filtering_table_dir, filtering_table_path),
+            (sequences_export_command, filtered_sequences_dir, filtered_sequences_path),
+        )
+        if dada2_ran or not is_up_to_date(export_dir, source)
+    ]
+
+    # Exports of table and sequences don't depend on each other.
+    for command in export_commands:
+        utils.log_command(logger, command)
+    if export_commands:
+        utils.run_commands_concurrently(
+            export_commands,
+            env_with_tmpdir,
+            args,
+            script_name,
+            logger,
+        )
+
 
 def preprocess(args: argparse.Namespace, logger: Logger, script_name: str) -> int:
     if args.verbose or args.debug:
@@ -143,28 +328,33 @@ def preprocess(args: argparse.Namespace, logger: Logger, script_name: str) -> in
 
     if args.qiime_path is None:
         print(
-            f"\033[31m\033[1m{script_name}: error:\033[0m: could not find qiime2 executable in $PATH"  # ]]]
+            utils.ERR_PREFIX.format(script_name),
+            "could not find qiime2 executable in $PATH",
         )
         return 1
 
     manifest = pathlib.Path(args.qiime2_manifest)
     if not manifest.exists():
         print(
-            f"\033[31m\033[1m{script_name}: error:\033[0m: {manifest}: No such file or directory!"  # ]]]
+            utils.ERR_PREFIX.format(script_name),
+            f"{manifest}: No such file or directory!",
         )
         return 1
 
     # Validate outdir path. If it doesn't exist, create it.
     output_dir: pathlib.Path = pathlib.Path(args.outdir)
-    logger.debug(f"Checking if output directory ({output_dir}) exists.")
-    if not output_dir.exists():
-        logger.info(f"Output directory: {output_dir}, doesn't exist; creating it.")
-        output_dir.mkdir()
+    logger.debug(f"Creating output directory ({output_dir}) if it doesn't exist.")
+    try:
+        output_dir.mkdir(parents=True)
+        logger.info(f"Output directory: {output_dir}, didn't exist; created it.")
+    except FileExistsError:
+        pass
 
     imported_reads_artifact_path = output_dir / "reads.qza"
 
     logger.debug("Setting trimming parameters.")
-    trimming_parameters: list[tuple[int, ...]] = list(
+    # Repeated values would only rerun dada2 with the same parameters.
+    trimming_parameters: dict[tuple[int, ...], None] = dict.fromkeys(
         itertools.product(
             args.trunc_len_f,
             args.trunc_len_r,
@@ -178,132 +368,62 @@ def preprocess(args: argparse.Namespace, logger: Logger, script_name: str) -> in
     # to errors during runnign qiime2 commands
     logger.debug(f"Setting new tmpdir.")
     tmp_dir = pathlib.Path(args.tmp_dir)
-    if not tmp_dir.exists():
-        tmp_dir.mkdir()
+    tmp_dir.mkdir(parents=True, exist_ok=True)
     env_with_tmpdir = utils.new_tmp_dir_env(tmp_dir, logger)
 
+    # Paths are passed to command builders as strings, converted once.
+    imported_reads_artifact = str(imported_reads_artifact_path)
     import_command = qiime_tools_import(
-        args.qiime_path, manifest, imported_reads_artifact_path
+        args.qiime_path, str(manifest), imported_reads_artifact
     )
     demux_summarization_command = qiime_demux_summarize(
         args.qiime_path,
-        imported_reads_artifact_path,
-        imported_reads_artifact_path.with_suffix(".qzv"),
+        imported_reads_artifact,
+        str(imported_reads_artifact_path.with_suffix(".qzv")),
     )
 
-    logger.info(f"Running command: `{utils.command_to_str(import_command)}`")
+    utils.log_command(logger, import_command)
     utils.run_command_with_output(
         import_command, env_with_tmpdir, args, script_name, logger
     )
-    logger.info(
-        f"Running command: `{utils.command_to_str(demux_summarization_command)}`"
-    )
+    utils.log_command(logger, demux_summarization_command)
     utils.run_command_with_output(
         demux_summarization_command, env_with_tmpdir, args, script_name, logger
     )
 
-    def filter_and_merge(
-        trunc_f: int, trunc_r: int, trim_f: int, trim_r: int, trunc_q: int
-    ):
-        filtering_stats_path = (
-            output_dir
-            / f"filtering_stats_{trunc_f}_{trunc_r}_{trim_f}_{trim_r}_{trunc_q}.qza"
-        )
-        logger.debug(f"filtering stats path: {filtering_stats_path}")
-
-        filtered_sequences_path = (
-            output_dir
-            / f"filtered_reads_{trunc_f}_{trunc_r}_{trim_f}_{trim_r}_{trunc_q}.qza"
-        )
-        logger.debug(f"filtered sequences path: {filtering_stats_path}")
-
-        filtering_table_path = (
-            output_dir
-            / f"filtering_table_{trunc_f}_{trunc_r}_{trim_f}_{trim_r}_{trunc_q}.qza"
-        )
-        logger.debug(f"filtering table path: {filtering_stats_path}")
-
-        dada2_command = qiime_dada2(
-            args.qiime_path,
-            imported_reads_artifact_path,
-            filtering_stats_path,
-            filtered_sequences_path,
-            filtering_table_path,
-            truncate_forward_at=trunc_f,
-            truncate_reverse_at=trunc_r,
-            trim_forward_by=trim_f,
-            trim_reverse_by=trim_r,
-            truncate_threshold_quality=trunc_q,
-            verbose=args.verbose,
-        )
-
-        logger.info(f"Running command: {utils.command_to_str(dada2_command)}")
-        utils.run_command_with_output(
-            dada2_command, env_with_tmpdir, args, script_name, logger
-        )
-
-        filtering_stats_command = qiime_metadata_tabulate(
-            args.qiime_path,
-            filtering_stats_path,
-            filtering_stats_path.with_suffix(".qzv"),
-        )
-        table_visualiztion_command = qiime_feature_table_summarize(
-            args.qiime_path,
-            filtering_table_path,
-            filtering_table_path.with_suffix(".qzv"),
-        )
-
-        logger.info(f"Running command: {utils.command_to_str(filtering_stats_command)}")
-        utils.run_command_with_output(
-            filtering_stats_command, env_with_tmpdir, args, script_name, logger
-        )
-        logger.info(
-            f"Running command: {utils.command_to_str(table_visualiztion_command)}"
-        )
-        utils.run_command_with_output(
-            table_visualiztion_command, env_with_tmpdir, args, script_name, logger
-        )
-
-        filtering_table_dir = output_dir / filtering_table_path.stem
-        logger.debug(f"Creating filtering table output dir: {filtering_table_dir}")
-        filtering_table_dir.mkdir()
-
-        table_export_command = qiime_tools_export(
-            args.qiime_path, filtering_table_path, filtering_table_dir
-        )
-
-        filtered_sequences_dir = output_dir / filtered_sequences_path.stem
-        logger.debug(
-            f"Creating filtered sequences output dir: {filtered_sequences_dir}"
-        )
-        filtered_sequences_dir.mkdir()
-
-        sequences_export_command = qiime_tools_export(
-            args.qiime_path, filtered_sequences_path, filtered_sequences_dir
-        )
-
-        logger.info(f"Running command: {utils.command_to_str(table_export_command)}")
-        utils.run_command_with_output(
-            table_export_command, env_with_tmpdir, args, script_name, logger
-        )
-        logger.info(
-            f"Running command: {utils.command_to_str(sequences_export_command)}"
-        )
-        utils.run_command_with_output(
-            sequences_export_command, env_with_tmpdir, args, script_name, logger
-        )
+    # Arguments shared by every dada2 run are put together once.
+    dada2_prefix = qiime_dada2_prefix(
+        args.qiime_path, imported_reads_artifact, verbose=args.verbose
+    )
 
     logger.info(
-        f"Combinations of trimming and quality-based truncation parameters: {trimming_parameters}"
+        "Combinations of trimming and quality-based truncation parameters: %s",
+        list(trimming_parameters),
     )
     logger.info(
         f"Running filtering and merging for different combinations of parameters."
     )
-    # joblib.Parallel(n_jobs=args.threads)(
-    #     joblib.delayed(filter_and_merge)(trunc_f, trunc_r, trim_f, trim_r, trunc_q)
-    #     for trunc_f, trunc_r, trim_f, trim_r, trunc_q in trimming_parameters
-    # )
-    for trunc_f, trunc_r, trim_f, trim_r, trunc_q in trimming_parameters:
-        filter_and_merge(trunc_f, trunc_r, trim_f, trim_r, trunc_q)
+    # Export directories are created up front rather than by the workers.
+    for parameters in trimming_parameters:
+        for export_dir in export_dirs(output_dir, parameters):
+            logger.debug(f"Creating export dir: {export_dir}")
+            export_dir.mkdir(exist_ok=True)
+
+    run_combination = functools.partial(
+        filter_and_merge,
+        args,
+        logger,
+        script_name,
+        output_dir,
+        env_with_tmpdir,
+        imported_reads_artifact_path,
+        dada2_prefix,
+    )
+    # filter_and_merge only waits on qiime2 subprocesses, so threads give the
+    # same parallelism as worker processes without spawning or pickling them.
+    joblib.Parallel(n_jobs=args.threads, prefer="threads")(
+        joblib.delayed(run_combination)(*parameters)
+        for parameters in trimming_parameters
+    )
 
     return 0
@@ -1,6 +1,7 @@
 import argparse
 import os
 import pathlib
+import types
 from logging import Logger
 
 from euglenida import utils
@@ -13,57 +14,66 @@ def quality_control(args: argparse.Namespace, logger: Logger, script_name) -> in
     # Validate input file paths
     input_files = [pathlib.Path(path) for path in args.input_files]
     logger.debug(f"Validating input file paths: {[str(file) for file in input_files]}")
-    files_exist = [path.exists() for path in input_files]
-    if not all(files_exist):
-        non_existent_file = input_files[files_exist.index(False)]
+    non_existent_file = next((path for path in input_files if not path.exists()), None)
+    if non_existent_file is not None:
         print(
-            f"\033[31m\033[1m{script_name}: error:\033[0m: {non_existent_file}: No such file or directory!"  # ]]]
+            utils.ERR_PREFIX.format(script_name),
+            f"{non_existent_file}: No such file or directory!",
         )
         return 1
 
     # Validate outdir path. If it doesn't exist, create it.
     output_dir: pathlib.Path = pathlib.Path(args.outdir)
-    logger.debug(f"Checking if output directory ({output_dir}) exists.")
-    if not output_dir.exists():
-        logger.info(f"Output directory: {output_dir}, doesn't exist; creating it.")
-        output_dir.mkdir()
+    logger.debug(f"Creating output directory ({output_dir}) if it doesn't exist.")
+    try:
+        output_dir.mkdir(parents=True)
+        logger.info(f"Output directory: {output_dir}, didn't exist; created it.")
+    except FileExistsError:
+        pass
 
     # Create fastqc file if it doesn't exist.
     fastqc_dir: pathlib.Path = output_dir / args.fastqc_dirname
-    logger.debug(f"Checking if fastqc directory ({fastqc_dir}) exists.")
-    if not fastqc_dir.exists():
-        logger.info(f"Fastqc directory: {fastqc_dir}, doesn't exist; creating it.")
+    logger.debug(f"Creating fastqc directory ({fastqc_dir}) if it doesn't exist.")
+    try:
         fastqc_dir.mkdir()
+        logger.info(f"Fastqc directory: {fastqc_dir}, didn't exist; created it.")
+    except FileExistsError:
+        pass
 
     # Create multiqc file if it doesn't exist.
     multiqc_dir: pathlib.Path = output_dir / args.multiqc_dirname
-    logger.debug(f"Checking if multiqc directory ({multiqc_dir}) exists.")
-    if not multiqc_dir.exists():
-        logger.info(f"Multiqc directory: {multiqc_dir}, doesn't exist; creating it.")
+    logger.debug(f"Creating multiqc directory ({multiqc_dir}) if it doesn't exist.")
+    try:
         multiqc_dir.mkdir()
+        logger.info(f"Multiqc directory: {multiqc_dir}, didn't exist; created it.")
+    except FileExistsError:
+        pass
+
+    # The same environment is shared by every command; it is never modified.
+    env = types.MappingProxyType(os.environ.copy())
 
     fastqc_command = [
-        f"{args.fastqc_path}",
+        str(args.fastqc_path),
         "--nogroup",
         "--threads",
-        f"{args.threads}",
+        str(args.threads),
         *input_files,
         "--outdir",
-        f"{fastqc_dir}",
+        str(fastqc_dir),
     ]
-    logger.info(f"Running command: {utils.command_to_str(fastqc_command)}")
-    utils.run_command_with_output(fastqc_command, os.environ.copy(), args, script_name, logger)
+    utils.log_command(logger, fastqc_command)
+    utils.run_command_with_output(fastqc_command, env, args, script_name, logger)
 
     multiqc_command = [
-        f"{args.multiqc_path}",
+        str(args.multiqc_path),
         "--interactive",
         "--export",
-        f"{fastqc_dir}",
+        str(fastqc_dir),
         "--outdir",
-        f"{multiqc_dir}",
+        str(multiqc_dir),
     ]
-    logger.info(f"Running command: {utils.command_to_str(multiqc_command)}")
-    utils.run_command_with_output(multiqc_command, os.environ.copy(), args, script_name, logger)
+    utils.log_command(logger, multiqc_command)
+    utils.run_command_with_output(multiqc_command, env, args, script_name, logger)
 
     logger.info("Qulity control script finished succesfully")
     return 0
@@ -1,142 +1,139 @@
 import argparse
+import functools
+import os
 import pathlib
 from logging import Logger
-from typing import List, Optional, Union
+from typing import Optional, Tuple, Union
 
 from euglenida import utils
 
 
+# Builders return tuples, so a cached command can safely be shared between calls.
+@functools.lru_cache(maxsize=8)
 def qiime_classify(
     qiime_path: str,
     classifier_path: Union[pathlib.Path, str],
     reads_path: Union[pathlib.Path, str],
     output_path: Union[pathlib.Path, str],
-) -> List[str]:
-    return [
+) -> Tuple[str, ...]:
+    return (
         qiime_path,
         "feature-classifier",
         "classify-sklearn",
         "--i-classifier",
-        f"{classifier_path}",
+        os.fspath(classifier_path),
         "--i-reads",
-        f"{reads_path}",
+        os.fspath(reads_path),
         "--o-classification",
-        f"{output_path}",
-    ]
+        os.fspath(output_path),
+    )
 
 
+@functools.lru_cache(maxsize=8)
 def qiime_metadata_tabulate(
     qiime_path: str,
     classification_path: Union[pathlib.Path, str],
     classification_visualization_path: Union[pathlib.Path, str],
-) -> List[str]:
-    return [
+) -> Tuple[str, ...]:
+    return (
         qiime_path,
         "metadata",
         "tabulate",
         "--m-input-file",
-        f"{classification_path}",
+        os.fspath(classification_path),
         "--o-visualization",
-        f"{classification_visualization_path}",
-    ]
+        os.fspath(classification_visualization_path),
+    )
 
 
+@functools.lru_cache(maxsize=8)
 def qiime_taxa_barplot(
     qiime_path: str,
     table_path: Union[pathlib.Path, str],
     classification_path: Union[pathlib.Path, str],
     output_barplot_path: Union[pathlib.Path, str],
     metadata_file: Optional[Union[pathlib.Path, str]] = None,
-) -> List[str]:
-    if metadata_file is not None:
-        return [
-            qiime_path,
-            "taxa",
-            "barplot",
-            "--i-table",
-            f"{table_path}",
-            "--i-taxonomy",
-            f"{classification_path}",
-            "--m-metadata-file",
-            f"{metadata_file}",
-            "--o-visualization",
-            f"{output_barplot_path}",
-        ]
-    return [
+) -> Tuple[str, ...]:
+    command = (
         qiime_path,
         "taxa",
         "barplot",
         "--i-table",
-        f"{table_path}",
+        os.fspath(table_path),
         "--i-taxonomy",
-        f"{classification_path}",
-        "--o-visualization",
-        f"{output_barplot_path}",
-    ]
+        os.fspath(classification_path),
+    )
+    if metadata_file is not None:
+        command += ("--m-metadata-file", os.fspath(metadata_file))
+    return command + ("--o-visualization", os.fspath(output_barplot_path))
 
 
+@functools.lru_cache(maxsize=8)
 def qiime_alignment_mafft(
     qiime_path: str,
     input_sequences_path: Union[pathlib.Path, str],
     output_alignment_path: Union[pathlib.Path, str],
-) -> List[str]:
-    return [
+) -> Tuple[str, ...]:
+    return (
         qiime_path,
         "alignment",
         "mafft",
         "--i-sequences",
-        f"{input_sequences_path}",
+        os.fspath(input_sequences_path),
         "--o-alignment",
-        f"{output_alignment_path}",
-    ]
+        os.fspath(output_alignment_path),
+    )
 
 
+@functools.lru_cache(maxsize=8)
 def qiime_alignment_mask(
     qiime_path: str,
     input_alignment_path: Union[pathlib.Path, str],
     output_trimmed_alignment_path: Union[pathlib.Path, str],
-) -> List[str]:
-    return [
+) -> Tuple[str, ...]:
+    return (
         qiime_path,
         "alignment",
         "mask",
         "--i-alignment",
-        f"{input_alignment_path}",
+        os.fspath(input_alignment_path),
         "--o-masked-alignment",
-        f"{output_trimmed_alignment_path}",
-    ]
+        os.fspath(output_trimmed_alignment_path),
+    )
 
 
+@functools.lru_cache(maxsize=8)
 def qiime_phylogeny_fasttree(
     qiime_path: str,
     input_alignment_path: Union[pathlib.Path, str],
     output_tree_path: Union[pathlib.Path, str],
-) -> List[str]:
-    return [
+) -> Tuple[str, ...]:
+    return (
         qiime_path,
         "phylogeny",
         "fasttree",
         "--i-alignment",
-        f"{input_alignment_path}",
+        os.fspath(input_alignment_path),
         "--o-tree",
-        f"{output_tree_path}",
-    ]
+        os.fspath(output_tree_path),
+    )
 
 
+@functools.lru_cache(maxsize=8)
 def qiime_phylogeny_midpoint_root(
     qiime_path: str,
     input_tree_path: Union[pathlib.Path, str],
     output_rooted_tree_path: Union[pathlib.Path, str],
-) -> List[str]:
-    return [
+) -> Tuple[str, ...]:
+    return (
         qiime_path,
         "phylogeny",
         "midpoint-root",
         "--i-tree",
-        f"{input_tree_path}",
+        os.fspath(input_tree_path),
         "--o-rooted-tree",
-        f"{output_rooted_tree_path}",
-    ]
+        os.fspath(output_rooted_tree_path),
+    )
 
 
 def classify(args: argparse.Namespace, logger: Logger, script_name: str) -> int:
@@ -145,47 +142,37 @@ def classify(args: argparse.Namespace, logger: Logger, script_name: str) -> int:
 
     if args.qiime_path is None:
         print(
-            f"\033[31m\033[1m{script_name}: error:\033[0m: could not find qiime2 executable in $PATH"  # ]]]
+            utils.ERR_PREFIX.format(script_name),
+            "could not find qiime2 executable in $PATH",
         )
         return 1
 
     classifier = pathlib.Path(args.classifier)
-    logger.debug(f"Validating classifier file path: {classifier}")
-    if not classifier.exists():
-        print(
-            f"\033[31m\033[1m{script_name}: error:\033[0m: {classifier}: No such file or directory!"  # ]]]
-        )
-        return 1
-
     reads_path = pathlib.Path(args.input_sequences)
-    logger.debug(f"Validating reads file path: {reads_path}")
-    if not reads_path.exists():
-        print(
-            f"\033[31m\033[1m{script_name}: error:\033[0m: {reads_path}: No such file or directory!"  # ]]]
-        )
-        return 1
-
     table_path = pathlib.Path(args.input_table)
-    logger.debug(f"Validating table file path: {table_path}")
-    if not table_path.exists():
-        print(
-            f"\033[31m\033[1m{script_name}: error:\033[0m: {table_path}: No such file or directory!"  # ]]]
-        )
-        return 1
+    for path, role in ((classifier, "classifier"), (reads_path, "reads"), (table_path, "table")):
+        logger.debug("Validating %s file path: %s", role, path)
+        if not path.exists():
+            print(
+                utils.ERR_PREFIX.format(script_name),
+                f"{path}: No such file or directory!",
+            )
+            return 1
 
     # Validate outdir path. If it doesn't exist, create it.
     output_dir: pathlib.Path = pathlib.Path(args.outdir)
-    logger.debug(f"Checking if output directory ({output_dir}) exists.")
-    if not output_dir.exists():
-        logger.info(f"Output directory: {output_dir}, doesn't exist; creating it.")
-        output_dir.mkdir()
+    logger.debug("Creating output directory (%s) if it doesn't exist.", output_dir)
+    try:
+        output_dir.mkdir(parents=True)
+        logger.info("Output directory: %s, didn't exist; created it.", output_dir)
+    except FileExistsError:
+        pass
 
     # Handle the changing of qiime2 tmp directory. If not done can sometimes lead
     # to errors during runnign qiime2 commands
-    logger.debug(f"Setting new tmpdir.")
+    logger.debug("Setting new tmpdir.")
     tmp_dir = pathlib.Path(args.tmp_dir)
-    if not tmp_dir.exists():
-        tmp_dir.mkdir()
+    tmp_dir.mkdir(parents=True, exist_ok=True)
     env_with_tmpdir = utils.new_tmp_dir_env(tmp_dir, logger)
 
     classification_path = output_dir / "classification.qza"
@@ -198,16 +185,13 @@ def classify(args: argparse.Namespace, logger: Logger, script_name: str) -> int:
         tmp_dir,
         '1' if (args.verbose or args.debug) else '0'
     ]
-    logger.info(f"Running command: {utils.command_to_str(classification_command)}")
+    utils.log_command(logger, classification_command)
     utils.run_command_with_output(classification_command, env_with_tmpdir, args, script_name, logger)
 
-    classification_metadata_path = classification_path.with_suffix(".qzv")
+    classification_metadata_path = output_dir / "classification.qzv"
     metadata_tabulate_command = qiime_metadata_tabulate(
         args.qiime_path, classification_path, classification_metadata_path
     )
-    logger.info(f"Running command: {utils.command_to_str(metadata_tabulate_command)}")
-    utils.run_command_with_output(metadata_tabulate_command, env_with_tmpdir, args, script_name, logger)
-
     barplot_output_path = output_dir / "barplot.qzv"
 
     logger.debug("Checking if metadata file was passed in.")
@@ -216,7 +200,8 @@ def classify(args: argparse.Namespace, logger: Logger, script_name: str) -> int:
         logger.debug("Checking if passed in metadata file exists.")
         if not metadata.exists() and (args.verbose or args.debug):
             print(
-                f"\033[31m\033[1m{script_name}: error:\033[0m: {table_path}: No such file or directory!"  # ]]]
+                utils.ERR_PREFIX.format(script_name),
+                f"{table_path}: No such file or directory!",
             )
             return 1
         taxa_barplot_command = qiime_taxa_barplot(
@@ -231,8 +216,12 @@ def classify(args: argparse.Namespace, logger: Logger, script_name: str) -> int:
             args.qiime_path, table_path, classification_path, barplot_output_path
         )
 
-    logger.info(f"Running command: {utils.command_to_str(taxa_barplot_command)}")
-    utils.run_command_with_output(taxa_barplot_command, env_with_tmpdir, args, script_name, logger)
+    # Tabulating the classification and the barplot both only read its output.
+    utils.log_command(logger, metadata_tabulate_command)
+    utils.log_command(logger, taxa_barplot_command)
+    utils.run_commands_concurrently(
+        [metadata_tabulate_command, taxa_barplot_command], env_with_tmpdir, args, script_name, logger
+    )
 
     return 0
 
@@ -243,31 +232,34 @@ def rooted_tree(args: argparse.Namespace, logger: Logger, script_name: str):
 
     if args.qiime_path is None:
         print(
-            f"\033[31m\033[1m{script_name}: error:\033[0m: could not find qiime2 executable in $PATH"  # ]]]
+            utils.ERR_PREFIX.format(script_name),
+            "could not find qiime2 executable in $PATH",
         )
         return 1
 
     reads_path = pathlib.Path(args.input_sequences)
-    logger.debug(f"Validating reads file path: {reads_path}")
+    logger.debug("Validating reads file path: %s", reads_path)
     if not reads_path.exists():
         print(
-            f"\033[31m\033[1m{script_name}: error:\033[0m: {reads_path}: No such file or directory!"  # ]]]
+            utils.ERR_PREFIX.format(script_name),
+            f"{reads_path}: No such file or directory!",
         )
         return 1
 
     # Validate outdir path. If it doesn't exist, create it.
     output_dir: pathlib.Path = pathlib.Path(args.outdir)
-    logger.debug(f"Checking if output directory ({output_dir}) exists.")
-    if not output_dir.exists():
-        logger.info(f"Output directory: {output_dir}, doesn't exist; creating it.")
-        output_dir.mkdir()
+    logger.debug("Creating output directory (%s) if it doesn't exist.", output_dir)
+    try:
+        output_dir.mkdir(parents=True)
+        logger.info("Output directory: %s, didn't exist; created it.", output_dir)
+    except FileExistsError:
+        pass
 
     # Handle the changing of qiime2 tmp directory. If not done can sometimes lead
     # to errors during runnign qiime2 commands
-    logger.debug(f"Setting new tmpdir.")
+    logger.debug("Setting new tmpdir.")
     tmp_dir = pathlib.Path(args.tmp_dir)
-    if not tmp_dir.exists():
-        tmp_dir.mkdir()
+    tmp_dir.mkdir(parents=True, exist_ok=True)
     env_with_tmpdir = utils.new_tmp_dir_env(tmp_dir, logger)
 
     alignment_output_path = output_dir / "alignment.qza"
@@ -288,13 +280,13 @@ def rooted_tree(args: argparse.Namespace, logger: Logger, script_name: str):
         args.qiime_path, tree_path, rooted_tree_path
     )
 
-    logger.info(f"Running command: {utils.command_to_str(alignment_command)}")
+    utils.log_command(logger, alignment_command)
     utils.run_command_with_output(alignment_command, env_with_tmpdir, args, script_name, logger)
-    logger.info(f"Running command: {utils.command_to_str(trimmed_alignment_command)}")
+    utils.log_command(logger, trimmed_alignment_command)
     utils.run_command_with_output(trimmed_alignment_command, env_with_tmpdir, args, script_name, logger)
-    logger.info(f"Running command: {utils.command_to_str(tree_command)}")
+    utils.log_command(logger, tree_command)
     utils.run_command_with_output(tree_command, env_with_tmpdir, args, script_name, logger)
-    logger.info(f"Running command: {utils.command_to_str(root_command)}")
+    utils.log_command(logger, root_command)
     utils.run_command_with_output(root_command, env_with_tmpdir, args, script_name, logger)
 
     return 0
@@ -1,51 +1,156 @@
 import argparse
+import asyncio
+import codecs
+import itertools
+import logging
 import os 
-import subprocess 
 import pathlib
+import shlex
+import sys
+import types
 from logging import Logger
-from typing import Any, List
+from typing import Any, List, Mapping, Optional, Sequence
 
+__all__ = [
+    "ERR_PREFIX",
+    "command_label",
+    "command_to_str",
+    "log_command",
+    "new_tmp_dir_env",
+    "print_args",
+    "run_command_with_output",
+    "run_commands_concurrently",
+]
 
-def command_to_str(command: List[Any]) -> str:
-    return ' '.join([str(item) for item in command])
+ERR_PREFIX = "\033[31m\033[1m{}: error:\033[0m:"  # ]]]
+OUTPUT_CHUNK_SIZE = 1 << 16
+_ELLIPSIS = ("...",)
 
 
-def new_tmp_dir_env(new_path: pathlib.Path, logger: Logger) -> dict[str, str]:
-    logger.debug(f"Creating envrionment with $TMPDIR={new_path.resolve()}")
+def command_to_str(command: Sequence[Any]) -> str:
+    return shlex.join(map(str, command))
+
+
+def log_command(logger: Logger, command: Sequence[Any]) -> None:
+    # Commands are only joined when the message would actually be emitted.
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("Running command: %s", command_to_str(command))
+
+
+def new_tmp_dir_env(new_path: pathlib.Path, logger: Logger) -> Mapping[str, str]:
+    resolved = new_path.resolve()
     current_env = os.environ.copy()
-    current_env["TMPDIR"] = f"'{new_path.resolve()}'"
-    logger.debug("Current shell envrionment:")
-    logger.debug(f"{current_env}")
-    return current_env
+    current_env["TMPDIR"] = f"'{resolved}'"
+    # Only TMPDIR differs from the shell environment, so only it is logged.
+    logger.debug("Creating envrionment with $TMPDIR=%s", current_env["TMPDIR"])
+    # Shared by every command of a run, so it is handed out read-only.
+    return types.MappingProxyType(current_env)
 
 
 def print_args(args: argparse.Namespace, script_name) -> None:
-    print(f"{script_name}: passed arguemnts:")
+    rows = [f"{script_name}: passed arguemnts:"]
     for arg, value in args._get_kwargs():
         if isinstance(value, list) and len(value) > 5:
-            print(f"\t{arg:<16}: [{' '.join(value[:2] +  ['...'] +value[-2:])}]")
+            shortened = itertools.chain(value[:2], _ELLIPSIS, value[-2:])
+            rows.append(f"\t{arg:<16}: [{' '.join(map(str, shortened))}]")
         else:
-            print(f"\t{arg:<16}: {value}")
+            rows.append(f"\t{arg:<16}: {value}")
+    sys.stdout.write("\n".join(rows) + "\n")
 
 
-def run_command_with_output(
-    command: List[str], env: dict[str, str], args: argparse.Namespace, script_name: str, logger: Logger
+def _tag_lines(text: str, label: Optional[str]) -> str:
+    if label is None:
+        return text
+    return "".join(f"[{label}] {line}" for line in text.splitlines(keepends=True))
+
+
+async def _run_command_async(
+    command: Sequence[str],
+    env: Mapping[str, str],
+    args: argparse.Namespace,
+    script_name: str,
+    label: Optional[str] = None,
 ):
-    process = subprocess.Popen(
-        command,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        env=env
+    show_output = args.verbose or args.debug
+    # Output that won't be printed isn't read back through a pipe at all.
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        stdout=asyncio.subprocess.PIPE if show_output else asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.STDOUT,
+        env=env,
+        # Lets subprocess use posix_spawn instead of fork+exec. Descriptors
+        # opened by Python are non-inheritable anyway, so none leak.
+        close_fds=False,
     )
     try:
-        for line in process.stdout:  # type: ignore
-            if args.verbose or args.debug:
-                print(line.decode().strip(), flush=True)
-    except subprocess.SubprocessError as e:
-        if args.verbose or args.debug:
-            raise e
-        else:
-            print(
-                f"\033[31m\033[1m{script_name}: error:\033[0m: critical error occured while running {command[0]}."  # ]]]
-            )
-            return 1
+        if show_output:
+            # Whatever output is available is written and flushed at once, so
+            # bursts of lines cost one write while slow output still shows up
+            # immediately. Only complete lines are written, so output of
+            # concurrently running commands doesn't get mixed within a line;
+            # their lines are also prefixed with the label of the command.
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            pending = ""
+            while True:
+                chunk = await process.stdout.read(OUTPUT_CHUNK_SIZE)  # type: ignore
+                if not chunk:
+                    break
+                text = pending + decoder.decode(chunk)
+                end = max(text.rfind("\n"), text.rfind("\r")) + 1
+                if end:
+                    sys.stdout.write(_tag_lines(text[:end], label))
+                    sys.stdout.flush()
+                pending = text[end:]
+            sys.stdout.write(_tag_lines(pending + decoder.decode(b"", final=True), label))
+            sys.stdout.flush()
+    finally:
+        await process.wait()
+    if process.returncode != 0:
+        print(
+            ERR_PREFIX.format(script_name),
+            f"{command_to_str(command[:3])} exited with status {process.returncode}.",
+        )
+        return 1
+    return 0
+
+
+def run_command_with_output(
+    command: Sequence[str],
+    env: Mapping[str, str],
+    args: argparse.Namespace,
+    script_name: str,
+    logger: Logger,
+    label: Optional[str] = None,
+):
+    return asyncio.run(_run_command_async(command, env, args, script_name, label=label))
+
+
+def command_label(command: Sequence[Any]) -> str:
+    # Output artifacts are named after the parameters they were made with, so
+    # they tell apart the same step run for different inputs.
+    for option, value in zip(command, command[1:]):
+        if str(option).startswith("--o-") or option == "--output-path":
+            return os.path.basename(os.fspath(value))
+    return " ".join(map(str, command[1:3]))
+
+
+async def _gather_commands(
+    commands: Sequence[Sequence[str]], env: Mapping[str, str], args: argparse.Namespace, script_name: str
+):
+    return await asyncio.gather(
+        *(
+            _run_command_async(command, env, args, script_name, label=command_label(command))
+            for command in commands
+        )
+    )
+
+
+def run_commands_concurrently(
+    commands: Sequence[Sequence[str]],
+    env: Mapping[str, str],
+    args: argparse.Namespace,
+    script_name: str,
+    logger: Logger,
+):
+    # Each call runs its own event loop, so it is safe from joblib's worker threads.
+    return asyncio.run(_gather_commands(commands, env, args, script_name))